@@ -27,17 +27,21 @@
 #  https://github.com/vwt12eh8/hassio-ecoflow
 #  Combined the contents of __init__.py, receive.py, send.py, and rxtcp.py into
 #  one file.
-	
+
+from __future__ import annotations
 from typing import Any, Callable, Iterable, Optional, TypeVar, TypedDict, cast
+import collections
 import datetime
+import functools
+import random
 import struct
+import sys
+import time
 import logging
 import asyncio 
 
-#  Fedora repo does not have ReactiveX, must be installed from pip
-import reactivex.operators as ops
-from reactivex import Observable, Observer, Subject, compose, throw
-from reactivex.subject.replaysubject import ReplaySubject
+#  ReactiveX is optional now, see _import_rx().  The Fedora repo does not have
+#  it, it must be installed from pip.
 
 _LOGGER = logging.getLogger(__name__)
 
@@ -59,17 +63,97 @@ _crc8_tab = [0, 7, 14, 9, 28, 27, 18, 21, 56, 63, 54, 49, 36, 35, 42, 45, 112, 1
 _crc16_tab = [0, 49345, 49537, 320, 49921, 960, 640, 49729, 50689, 1728, 1920, 51009, 1280, 50625, 50305, 1088, 52225, 3264, 3456, 52545, 3840, 53185, 52865, 3648, 2560, 51905, 52097, 2880, 51457, 2496, 2176, 51265, 55297, 6336, 6528, 55617, 6912, 56257, 55937, 6720, 7680, 57025, 57217, 8000, 56577, 7616, 7296, 56385, 5120, 54465, 54657, 5440, 55041, 6080, 5760, 54849, 53761, 4800, 4992, 54081, 4352, 53697, 53377, 4160, 61441, 12480, 12672, 61761, 13056, 62401, 62081, 12864, 13824, 63169, 63361, 14144, 62721, 13760, 13440, 62529, 15360, 64705, 64897, 15680, 65281, 16320, 16000, 65089, 64001, 15040, 15232, 64321, 14592, 63937, 63617, 14400, 10240, 59585, 59777, 10560, 60161, 11200, 10880, 59969, 60929, 11968, 12160, 61249, 11520, 60865, 60545, 11328, 58369, 9408, 9600, 58689, 9984, 59329, 59009, 9792, 8704, 58049, 58241, 9024, 57601, 8640, 8320, 57409, 40961, 24768,
 			  24960, 41281, 25344, 41921, 41601, 25152, 26112, 42689, 42881, 26432, 42241, 26048, 25728, 42049, 27648, 44225, 44417, 27968, 44801, 28608, 28288, 44609, 43521, 27328, 27520, 43841, 26880, 43457, 43137, 26688, 30720, 47297, 47489, 31040, 47873, 31680, 31360, 47681, 48641, 32448, 32640, 48961, 32000, 48577, 48257, 31808, 46081, 29888, 30080, 46401, 30464, 47041, 46721, 30272, 29184, 45761, 45953, 29504, 45313, 29120, 28800, 45121, 20480, 37057, 37249, 20800, 37633, 21440, 21120, 37441, 38401, 22208, 22400, 38721, 21760, 38337, 38017, 21568, 39937, 23744, 23936, 40257, 24320, 40897, 40577, 24128, 23040, 39617, 39809, 23360, 39169, 22976, 22656, 38977, 34817, 18624, 18816, 35137, 19200, 35777, 35457, 19008, 19968, 36545, 36737, 20288, 36097, 19904, 19584, 35905, 17408, 33985, 34177, 17728, 34561, 18368, 18048, 34369, 33281, 17088, 17280, 33601, 16640, 33217, 32897, 16448]
 
+#  CRC16 table indexed by a whole little endian 16 bit word so the fast path
+#  consumes two bytes per lookup.  Built from _crc16_tab on first use, building
+#  it costs more than a typical command frame's CRC.
+_crc16_tab2 = None
+
+def _build_crc16_tab2():
+	global _crc16_tab2
+	_crc16_tab2 = [_crc16_tab[(t ^ hi) & 255] ^ (t >> 8) for hi in range(256) for t in _crc16_tab]
+	return _crc16_tab2
+
 NO_USB_SWITCH = {5, 7, 12, 14, 15, 18}
 
-class RxTcpAutoConnection:
+#  The sections of EcoFlowClient.diagnostics that get_status can wait for
+SECTIONS = ("pd", "ems", "inverter", "mppt", "bms")
+
+#  The EcoFlowClient stream that each (src, cmd_set, cmd_id) packet goes to
+ROUTES = {
+	(2, 32, 2): "pd",
+	(3, 32, 2): "ems",
+	(4, 32, 2): "inverter",
+	(5, 32, 2): "mppt",
+	(3, 32, 50): "bms",
+	(6, 32, 2): "bms",
+	(6, 32, 50): "bms",
+	(4, 32, 72): "dc_in_current_config",
+	(5, 32, 72): "dc_in_current_config",
+	(4, 32, 68): "dc_in_type",
+	(5, 32, 82): "dc_in_type",
+	(4, 32, 74): "fan_auto",
+	(2, 32, 40): "lcd_timeout",
+}
+
+#  The (src, cmd_set, cmd_id) of the packets that answer a command built by
+#  build2(), which is where the command was sent
+def request_key(command: bytes) -> tuple[int, int, int]:
+	return (command[13], command[14], command[15])
+
+#  "host" or "host:port", the port is PORT unless one is given
+def split_address(addr: str) -> tuple[str, int]:
+	(host, sep, port) = addr.rpartition(":")
+	if sep and host and ":" not in host and port.isdigit():
+		return (host, int(port))
+	return (addr, PORT)
+
+#  Load ReactiveX the first time an Rx class or operator is used, the core
+#  asyncio API doesn't need it and importing it is slow
+def _import_rx():
+	global ops, Observable, Observer, Subject, ReplaySubject
+	try:
+		import reactivex.operators as ops
+		from reactivex import Observable, Observer, Subject
+		from reactivex.subject.replaysubject import ReplaySubject
+	except ImportError as ex:
+		raise ImportError("the Rx API needs the reactivex module, install it with pip") from ex
+
+#  Keeps a connection to a device open, reconnecting whenever it drops.
+#
+#  Up to "read_size" bytes are read from the socket at once.  A connection
+#  attempt gives up after "connect_timeout" seconds, and a connection that
+#  hasn't received anything for "idle_timeout" seconds (None for never) is
+#  dropped and made again.  Failed attempts, and connections that drop before
+#  anything arrives, back off exponentially from "backoff_min" up to
+#  "backoff_max" seconds, with jitter so that devices don't retry in lockstep.
+class TcpAutoConnection:
 	__rx = None
 	__tx = None
 
-	def __init__(self, host: str, port: int):
+	def __init__(self, host: str, port: int, read_size: int = 65536, connect_timeout: float = 10.0, idle_timeout: Optional[float] = None, backoff_min: float = 1.0, backoff_max: float = 60.0):
 		self.host = host
 		self.port = port
-		self.received = Subject[Optional[bytes]]()
+		self.read_size = read_size
+		self.connect_timeout = connect_timeout
+		self.idle_timeout = idle_timeout
+		self.backoff_min = backoff_min
+		self.backoff_max = backoff_max
+		#  "connecting", "connected", "backoff" or "closed"
+		self.state = "connecting"
+		self.connects = 0
+		self.connect_failures = 0
+		self.idle_timeouts = 0
+		self.connect_latency: Optional[float] = None
+		self.bytes_received = 0
+		self.reads = 0
+		self.__connected_at = 0.0
+		self.__connection_bytes = 0
+		self.__last_received = 0.0
+		self.__watchdog: Optional[asyncio.TimerHandle] = None
+		self.__listeners = list[Callable[[Optional[bytes]], None]]()
 		self.__is_open = True
+		self.__closing = asyncio.Event()
+		self.__connected = asyncio.Event()
 		self.__task = asyncio.create_task(self.__loop())
 		self.__opened = asyncio.Future()
 
@@ -80,8 +164,14 @@ class RxTcpAutoConnection:
 		self.close()
 		await self.wait_closed()
 
+	#  "listener" is called with every chunk of bytes received, and with None
+	#  whenever the connection drops
+	def add_listener(self, listener: Callable[[Optional[bytes]], None]):
+		self.__listeners.append(listener)
+
 	def close(self):
 		self.__is_open = False
+		self.__closing.set()
 		if self.__rx:
 			self.__rx.feed_eof()
 
@@ -92,6 +182,23 @@ class RxTcpAutoConnection:
 		if self.__rx:
 			self.__rx.feed_eof()
 
+	#  The connection's state and counters.  "bytes_per_second" is the average
+	#  since the current connection was made.
+	def stats(self) -> dict[str, Any]:
+		connected = time.monotonic() - self.__connected_at if self.state == "connected" else 0.0
+		return {
+			"state": self.state,
+			"connects": self.connects,
+			"reconnects": max(0, self.connects - 1),
+			"connect_failures": self.connect_failures,
+			"idle_timeouts": self.idle_timeouts,
+			"connect_latency": self.connect_latency,
+			"connected_seconds": connected,
+			"bytes_received": self.bytes_received,
+			"reads": self.reads,
+			"bytes_per_second": self.__connection_bytes / connected if connected > 0 else 0.0,
+		}
+
 	async def wait_closed(self):
 		try:
 			await self.__task
@@ -105,125 +212,190 @@ class RxTcpAutoConnection:
 	async def wait_opened(self):
 		await self.__opened
 
+	#  Unlike wait_opened(), waits for the current connection if it dropped
+	async def wait_connected(self):
+		await self.__connected.wait()
+
 	def write(self, data: bytes):
 		self.__tx.write(data)
 
+	def _received(self, data: Optional[bytes]):
+		for listener in self.__listeners:
+			listener(data)
+
+	#  Called once when the connection loop ends, "ex" is the exception that
+	#  ended it if there was one
+	def _finished(self, ex: Optional[BaseException] = None):
+		pass
+
+	def __backoff(self, failures: int):
+		delay = min(self.backoff_max, self.backoff_min * 2 ** (failures - 1))
+		return delay / 2 + random.uniform(0, delay / 2)
+
+	#  Drop the connection if nothing has arrived for idle_timeout seconds.  One
+	#  timer per connection, not one per read.
+	def __check_idle(self):
+		idle = time.monotonic() - self.__last_received
+		if idle < self.idle_timeout:
+			self.__watchdog = asyncio.get_running_loop().call_later(self.idle_timeout - idle, self.__check_idle)
+			return
+		_LOGGER.debug(f"nothing from {self.host} for {idle:.0f} seconds, reconnecting")
+		self.idle_timeouts += 1
+		self.__watchdog = None
+		self.reconnect()
+
 	async def __loop(self):
+		failures = 0
 		while self.__is_open:
+			if failures:
+				delay = self.__backoff(failures)
+				_LOGGER.debug(f"reconnecting {self.host} in {delay:.1f} seconds")
+				self.state = "backoff"
+				try:
+					await asyncio.wait_for(self.__closing.wait(), delay)
+				except asyncio.TimeoutError:
+					pass
+				if not self.__is_open:
+					break
+			self.state = "connecting"
 			_LOGGER.debug(f"connecting {self.host}")
+			started = time.monotonic()
 			try:
-				(self.__rx, self.__tx) = await asyncio.open_connection(self.host, self.port)
+				(self.__rx, self.__tx) = await asyncio.wait_for(asyncio.open_connection(self.host, self.port), self.connect_timeout)
 			except Exception as ex:
-				_LOGGER.debug(ex)
-				await asyncio.sleep(1)
+				_LOGGER.debug(f"unable to connect {self.host}: {ex!r}")
+				self.connect_failures += 1
+				failures += 1
 				continue
-			_LOGGER.debug(f"connected {self.host}")
+			if not self.__is_open:
+				#  Closed while connecting
+				self.__tx.close()
+				break
+			self.__connected_at = self.__last_received = time.monotonic()
+			self.connect_latency = self.__connected_at - started
+			self.connects += 1
+			self.__connection_bytes = 0
+			self.state = "connected"
+			_LOGGER.debug(f"connected {self.host} in {self.connect_latency * 1000:.0f} ms")
 			if not self.__opened.done():
 				self.__opened.set_result(None)
+			self.__connected.set()
+			if self.idle_timeout:
+				self.__watchdog = asyncio.get_running_loop().call_later(self.idle_timeout, self.__check_idle)
 			try:
 				while not self.__rx.at_eof():
-					data = await self.__rx.read(1024)
-					_LOGGER.debug(data)
+					data = await self.__rx.read(self.read_size)
 					if data:
-						self.received.on_next(data)
+						self.__last_received = time.monotonic()
+						self.__connection_bytes += len(data)
+						self.bytes_received += len(data)
+						self.reads += 1
+						self._received(data)
 			except Exception as ex:
 				if type(ex) is not TimeoutError:
 					_LOGGER.exception(ex)
 			except BaseException as ex:
-				self.received.on_error(ex)
+				self.state = "closed"
+				self._finished(ex)
 				return
 			finally:
+				self.__connected.clear()
+				if self.__watchdog:
+					self.__watchdog.cancel()
+					self.__watchdog = None
 				self.__rx.feed_eof()
 				self.__tx.close()
-			self.received.on_next(None)
-		self.received.on_completed()
-		
+			#  A device that hangs up before sending anything backs off too
+			failures = 0 if self.__connection_bytes else failures + 1
+			self._received(None)
+		self.state = "closed"
+		self._finished()
+
+#  The original ReactiveX flavour of TcpAutoConnection, publishes the received
+#  bytes on the "received" subject
+class RxTcpAutoConnection(TcpAutoConnection):
+
+	def __init__(self, host: str, port: int, **options):
+		_import_rx()
+		self.received = Subject[Optional[bytes]]()
+		super().__init__(host, port, **options)
+		self.add_listener(self.received.on_next)
+
+	def _finished(self, ex: Optional[BaseException] = None):
+		if ex:
+			self.received.on_error(ex)
+		else:
+			self.received.on_completed()
+
+#  Decodes the frames arriving from one device and keeps the latest value of
+#  every stream in "latest" and of every section in "diagnostics".  Use
+#  messages() to receive each (stream name, value) as it arrives:
+#
+#     async for (name, value) in client.messages():
+#         ...
 class EcoFlowClient:
-	__disconnected = None
 	__extra_connected = False
-
-	def __init__(self, product_name, addr, timeout):
-		self.tcp = RxTcpAutoConnection(addr, PORT)
-		self.product: int = list(PRODUCTS.keys())[list(PRODUCTS.values()).index(product_name)]
+	_connection = TcpAutoConnection
+
+	#  "addr" is the device's address, with ":port" if it isn't on PORT.
+	#  "projection" optionally maps section names to the fields wanted from
+	#  them, only those fields are decoded from that section's frames.  Any
+	#  other keyword arguments go to the connection, see TcpAutoConnection.
+	def __init__(self, product_name, addr, timeout, projection: Optional[dict[str, Iterable[str]]] = None, **options):
+		self.tcp = self._connection(*split_address(addr), **options)
+		self.product = product_id(product_name)
 		self.diagnostics = dict[str, dict[str, Any]]()
+		self.latest = dict[str, Any]()
+		self.projection = dict[str, tuple[str, ...]]()
+		for (section, fields) in (projection or {}).items():
+			self.projection[section] = tuple(fields)
+		if "pd" in self.projection and "model" not in self.projection["pd"]:
+			#  pd_updated needs the model
+			self.projection["pd"] += ("model",)
+		self.__updated = asyncio.Event()
+		self.__queues = set[asyncio.Queue]()
+		self.__reader = FrameReader()
+
+		#  Commands waiting to be sent, and counts of the commands queued and
+		#  sent so far, see send()
+		self.__commands = list[bytes]()
+		self.__queued = 0
+		self.__sent = 0
+		self.__withdrawn = 0
+		self.__commands_queued = asyncio.Event()
+		self.__commands_sent = asyncio.Event()
+		self.__sender: Optional[asyncio.Task] = None
+		self.__closed = False
+
+		#  Futures waiting for a packet, by its (src, cmd_set, cmd_id), see
+		#  request()
+		self.__requests = dict[tuple[int, int, int], list[asyncio.Future]]()
 
 		self.device_info_main={}
 		self.device_info_main["manufacturer"] = "EcoFlow"
 
-		self.received = self.tcp.received.pipe(
-			merge_packet(),
-			ops.map(decode_packet),
-			ops.share(),
-		)
-		self.pd = self.received.pipe(
-			ops.filter(is_pd),
-			ops.map(lambda x: parse_pd(x[3], self.product)),
-			ops.multicast(subject=ReplaySubject(1, timeout)),
-			ops.ref_count(),
-		)
-		self.ems = self.received.pipe(
-			ops.filter(is_ems),
-			ops.map(lambda x: parse_ems(x[3], self.product)),
-			ops.multicast(subject=ReplaySubject(1, timeout)),
-			ops.ref_count(),
-		)
-		self.inverter = self.received.pipe(
-			ops.filter(is_inverter),
-			ops.map(lambda x: parse_inverter(x[3], self.product)),
-			ops.multicast(subject=ReplaySubject(1, timeout)),
-			ops.ref_count(),
-		)
-		self.mppt = self.received.pipe(
-			ops.filter(is_mppt),
-			ops.map(lambda x: parse_mppt(x[3], self.product)),
-			ops.multicast(subject=ReplaySubject(1, timeout)),
-			ops.ref_count(),
-		)
-		self.bms = self.received.pipe(
-			ops.filter(is_bms),
-			ops.map(lambda x: parse_bms(x[3], self.product)),
-			ops.multicast(subject=ReplaySubject(1, timeout)),
-			ops.ref_count(),
-		)
-
-		self.dc_in_current_config = self.received.pipe(
-			ops.filter(is_dc_in_current_config),
-			ops.map(lambda x: parse_dc_in_current_config(x[3])),
-		)
-		self.dc_in_type = self.received.pipe(
-			ops.filter(is_dc_in_type),
-			ops.map(lambda x: parse_dc_in_type(x[3])),
-		)
-		self.fan_auto = self.received.pipe(
-			ops.filter(is_fan_auto),
-			ops.map(lambda x: parse_fan_auto(x[3])),
-		)
-		self.lcd_timeout = self.received.pipe(
-			ops.filter(is_lcd_timeout),
-			ops.map(lambda x: parse_lcd_timeout(x[3])),
-		)
-
-		self.disconnected = Subject[Optional[int]]()
-
-		def _disconnected(*args):
-			self.__disconnected = None
-			self.tcp.reconnect()
-			self.diagnostics.clear()
-			self.disconnected.on_next(None)
-			if self.__extra_connected:
-				self.__extra_connected = False
-
-		def reset_timer(*args):
-			if self.__disconnected:
-				self.__disconnected()
-
-		def end_timer(ex=None):
-			self.disconnected.on_next(None)
-			if ex:
-				self.disconnected.on_error(ex)
-			else:
-				self.disconnected.on_completed()
-		self.received.subscribe(reset_timer, end_timer, end_timer)
+		#  Packets nobody handles, counted by (src, cmd_set, cmd_id)
+		self.unrouted = collections.Counter[tuple[int, int, int]]()
+
+		#  Messages handled, and the time the last one was received, by
+		#  stream name
+		self.messages_received = collections.Counter[str]()
+		self.received_at = dict[str, float]()
+
+		#  Every packet is routed once, by its (src, cmd_set, cmd_id), to the
+		#  parser of the stream it belongs to and the handler that keeps
+		#  diagnostics up to date
+		parsers = {
+			"pd": lambda d: parse_pd(d, self.product, self.projection.get("pd")),
+			"ems": lambda d: parse_ems(d, self.product, self.projection.get("ems")),
+			"inverter": lambda d: parse_inverter(d, self.product, self.projection.get("inverter")),
+			"mppt": lambda d: parse_mppt(d, self.product, self.projection.get("mppt")),
+			"bms": lambda d: parse_bms(d, self.product, self.projection.get("bms")),
+			"dc_in_current_config": parse_dc_in_current_config,
+			"dc_in_type": parse_dc_in_type,
+			"fan_auto": parse_fan_auto,
+			"lcd_timeout": parse_lcd_timeout,
+		}
 
 		def pd_updated(data: dict[str, Any]):
 			self.diagnostics["pd"] = data
@@ -232,30 +404,314 @@ class EcoFlowClient:
 			if self.__extra_connected != has_extra(self.product, data.get("model", None)):
 				self.__extra_connected = not self.__extra_connected
 				if not self.__extra_connected:
-					self.disconnected.on_next(1)
-		self.pd.subscribe(pd_updated)
+					self._extra_disconnected()
 
 		def bms_updated(data: tuple[int, dict[str, Any]]):
 			if "bms" not in self.diagnostics:
 				self.diagnostics["bms"] = dict[str, Any]()
 			self.diagnostics["bms"][data[0]] = data[1]
-		self.bms.subscribe(bms_updated)
 
 		def ems_updated(data: dict[str, Any]):
 			self.diagnostics["ems"] = data
-		self.ems.subscribe(ems_updated)
 
 		def inverter_updated(data: dict[str, Any]):
 			self.diagnostics["inverter"] = data
-		self.inverter.subscribe(inverter_updated)
 
 		def mppt_updated(data: dict[str, Any]):
 			self.diagnostics["mppt"] = data
-		self.mppt.subscribe(mppt_updated)
+
+		handlers = {
+			"pd": pd_updated,
+			"bms": bms_updated,
+			"ems": ems_updated,
+			"inverter": inverter_updated,
+			"mppt": mppt_updated,
+		}
+		self.__routes = {key: (name, parsers[name], handlers.get(name)) for (key, name) in ROUTES.items()}
+
+		self.tcp.add_listener(self.feed)
+
+	#  Feed bytes received from the device, None when the connection dropped
+	def feed(self, data: Optional[bytes]):
+		if data is None:
+			self.__reader.reset()
+			return
+		for frame in self.__reader.feed(data):
+			packet = decode_packet(frame)
+			self._packet(packet)
+			key = packet[0:3]
+			route = self.__routes.get(key)
+			if route is None:
+				self.unrouted[key] += 1
+				if key in self.__requests:
+					self.__answer(key, packet[3])
+				continue
+			(name, parser, handler) = route
+			try:
+				value = parser(packet[3])
+				if handler:
+					handler(value)
+			except Exception:
+				_LOGGER.exception(f"unable to handle {key} packet from {self.tcp.host}")
+				continue
+			if key in self.__requests:
+				self.__answer(key, value)
+			self.latest[name] = value
+			self.messages_received[name] += 1
+			self.received_at[name] = time.time()
+			self.__updated.set()
+			for queue in self.__queues:
+				if queue.full():
+					queue.get_nowait()
+				queue.put_nowait((name, value))
+			self._message(name, value)
+
+	#  Hooks for subclasses, called for every decoded packet and for every
+	#  routed message after it has been handled
+	def _packet(self, packet: tuple[int, int, int, bytes]):
+		pass
+
+	def _message(self, name: str, value: Any):
+		pass
+
+	def _extra_disconnected(self):
+		pass
+
+	#  Yields (stream name, value) for every message received until the
+	#  client is closed.  If the consumer falls more than "maxsize" messages
+	#  behind, the oldest ones are dropped.
+	async def messages(self, maxsize: int = 256):
+		queue = asyncio.Queue(maxsize)
+		self.__queues.add(queue)
+		try:
+			while True:
+				message = await queue.get()
+				if message is None:
+					return
+				yield message
+		finally:
+			self.__queues.discard(queue)
+
+	#  Whether "section" has been received from the device.  bms only counts
+	#  once the main battery pack (0) has reported, extra packs can come first.
+	def has_section(self, section: str) -> bool:
+		value = self.diagnostics.get(section)
+		return value is not None and (section != "bms" or 0 in value)
+
+	#  Wait until every one of "sections" has been received from the device or
+	#  "timeout" seconds have passed, whichever comes first.  Returns the list
+	#  of sections that are still missing.
+	async def wait_for(self, sections: Iterable[str], timeout: float):
+		loop = asyncio.get_running_loop()
+		deadline = loop.time() + timeout
+		while True:
+			missing = [s for s in sections if not self.has_section(s)]
+			remaining = deadline - loop.time()
+			if not missing or remaining <= 0:
+				return missing
+			self.__updated.clear()
+			try:
+				await asyncio.wait_for(self.__updated.wait(), remaining)
+			except asyncio.TimeoutError:
+				pass
+
+	#  Queue get/set commands, the frames built by the send.py part of the API,
+	#  to be sent to the device over this client's connection.  Commands
+	#  queued before the sender gets to run go out back to back in one write,
+	#  as soon as the device is connected.  If the connection drops before
+	#  they are drained they are sent again after it reconnects.
+	#
+	#     client.send(set_level_max(product, 95), set_ac_in_limit(800), set_ac_out(product, True))
+	#     await client.drain(10)
+	def send(self, *commands: bytes):
+		self.__commands.extend(commands)
+		self.__queued += len(commands)
+		if self.__sender is None:
+			self.__sender = asyncio.create_task(self.__send_commands())
+		self.__commands_queued.set()
+
+	#  Wait until every command queued so far has been written to the
+	#  connection and flushed, or raise asyncio.TimeoutError after "timeout"
+	#  seconds (None to wait as long as it takes)
+	async def drain(self, timeout: Optional[float] = None):
+		queued = self.__queued
+
+		async def sent():
+			while self.__sent + self.__withdrawn < queued:
+				if self.__closed:
+					raise ConnectionError(f"the client for {self.tcp.host} was closed")
+				self.__commands_sent.clear()
+				await self.__commands_sent.wait()
+
+		await asyncio.wait_for(sent(), timeout)
+
+	async def __send_commands(self):
+		while True:
+			await self.__commands_queued.wait()
+			await self.tcp.wait_connected()
+			commands = self.__commands
+			self.__commands = list[bytes]()
+			self.__commands_queued.clear()
+			try:
+				self.tcp.write(b"".join(commands))
+				await self.tcp.drain()
+			except Exception as ex:
+				#  Try again, in the same order, once it has reconnected
+				_LOGGER.debug(f"unable to send {len(commands)} commands to {self.tcp.host}: {ex!r}")
+				self.__commands[:0] = commands
+				self.__commands_queued.set()
+				await asyncio.sleep(0.1)
+				continue
+			self.__sent += len(commands)
+			self.__commands_sent.set()
+
+	#  Take a command that hasn't been sent yet back out of the queue, so the
+	#  get commands of requests that are over, like the ones that timed out
+	#  while the device was offline, don't pile up and go out once it's back
+	def __withdraw(self, command: bytes):
+		for (i, queued) in enumerate(self.__commands):
+			if queued is command:
+				del self.__commands[i]
+				self.__withdrawn += 1
+				self.__commands_sent.set()
+				return
+
+	#  Send a get command and wait for the device to answer it.  The answer is
+	#  the next packet from the (src, cmd_set, cmd_id) the command was sent to
+	#  (or "reply" if it comes from somewhere else), so a broadcast of the
+	#  same section answers it just as well.  Returns the parsed message if the
+	#  packet is routed (see ROUTES), otherwise its raw payload.  Raises
+	#  asyncio.TimeoutError if nothing arrives within "timeout" seconds.
+	#
+	#     ems = await client.request(get_ems_main())
+	async def request(self, command: bytes, timeout: float = 5, reply: Optional[tuple[int, int, int]] = None):
+		key = reply or request_key(command)
+		future = asyncio.get_running_loop().create_future()
+		self.__requests.setdefault(key, []).append(future)
+		try:
+			self.send(command)
+			return await asyncio.wait_for(future, timeout)
+		finally:
+			waiting = self.__requests.get(key)
+			if waiting and future in waiting:
+				waiting.remove(future)
+			if not waiting:
+				self.__requests.pop(key, None)
+			self.__withdraw(command)
+
+	#  Send a set command and read the setting back with "query", a get
+	#  command, until "check" accepts the answer, to know that it took effect.
+	#  Returns the answer that passed, raises asyncio.TimeoutError if none did
+	#  within "timeout" seconds.
+	#
+	#     await client.confirm(set_level_max(product, 90), get_ems_main(), lambda ems: ems["battery_level_max"] == 90)
+	async def confirm(self, command: bytes, query: bytes, check: Callable[[Any], bool], timeout: float = 5, interval: float = 0.5):
+		loop = asyncio.get_running_loop()
+		deadline = loop.time() + timeout
+		self.send(command)
+		while True:
+			value = await self.request(query, max(0, deadline - loop.time()))
+			if check(value):
+				return value
+			if loop.time() + interval >= deadline:
+				raise asyncio.TimeoutError(f"{self.tcp.host} did not confirm the setting within {timeout} seconds")
+			await asyncio.sleep(interval)
+
+	#  Active query mode: ask for the "sections" that have a get command (see
+	#  QUERIES) all at once, pipelined on the connection, and wait for the rest
+	#  to be broadcast, up to "timeout" seconds in all.  Returns the sections
+	#  that arrived and the list of the ones that didn't.  The sections asked
+	#  for are at most one round trip old, rather than as old as the device's
+	#  broadcast interval.
+	async def query(self, sections: Optional[Iterable[str]] = None, timeout: float = 5) -> tuple[dict[str, Any], list[str]]:
+		if sections is None:
+			sections = product_sections(self.product)
+		active = [s for s in sections if s in QUERIES]
+		passive = [s for s in sections if s not in QUERIES]
+		(missing, *replies) = await asyncio.gather(
+			self.wait_for(passive, timeout),
+			*(self.request(QUERIES[s](), timeout) for s in active),
+			return_exceptions=True)
+		snapshot = dict[str, Any]()
+		for (section, reply) in zip(active, replies):
+			if not isinstance(reply, BaseException):
+				snapshot[section] = reply
+		for section in passive:
+			if self.has_section(section):
+				value = self.diagnostics[section]
+				snapshot[section] = dict(value) if section == "bms" else value
+		return (snapshot, [s for s in sections if s not in snapshot])
+
+	def __answer(self, key: tuple[int, int, int], value: Any):
+		for future in self.__requests.pop(key):
+			if not future.done():
+				future.set_result(value)
 
 	async def close(self):
+		self.__closed = True
+		self.__commands_sent.set()
+		for futures in self.__requests.values():
+			for future in futures:
+				future.cancel()
+		self.__requests.clear()
+		if self.__sender:
+			self.__sender.cancel()
 		self.tcp.close()
 		await self.tcp.wait_closed()
+		for queue in self.__queues:
+			if queue.full():
+				queue.get_nowait()
+			queue.put_nowait(None)
+
+#  The original ReactiveX flavour of EcoFlowClient: "received" publishes every
+#  decoded packet and pd, ems, inverter, mppt, bms, dc_in_current_config,
+#  dc_in_type, fan_auto and lcd_timeout publish the parsed messages.  Needs
+#  the reactivex module.
+class RxEcoFlowClient(EcoFlowClient):
+	_connection = RxTcpAutoConnection
+
+	def __init__(self, product_name, addr, timeout, projection: Optional[dict[str, Iterable[str]]] = None, **options):
+		_import_rx()
+		self.received = Subject()
+		self.pd = ReplaySubject(1, timeout)
+		self.ems = ReplaySubject(1, timeout)
+		self.inverter = ReplaySubject(1, timeout)
+		self.mppt = ReplaySubject(1, timeout)
+		self.bms = ReplaySubject(1, timeout)
+		self.dc_in_current_config = Subject()
+		self.dc_in_type = Subject()
+		self.fan_auto = Subject()
+		self.lcd_timeout = Subject()
+		self.disconnected = Subject[Optional[int]]()
+		super().__init__(product_name, addr, timeout, projection, **options)
+		if hasattr(self.tcp, "received"):
+			#  The subjects end when the connection does
+			self.tcp.received.subscribe(on_completed=self.__finished, on_error=self.__finished)
+
+	#  Complete every subject, or with "ex" fail them.  "disconnected" is
+	#  completed by close(), after it publishes None.
+	def __finished(self, ex: Optional[BaseException] = None):
+		subjects = (self.received, self.pd, self.ems, self.inverter, self.mppt, self.bms, self.dc_in_current_config, self.dc_in_type, self.fan_auto, self.lcd_timeout)
+		for subject in subjects + ((self.disconnected,) if ex else ()):
+			if ex:
+				subject.on_error(ex)
+			else:
+				subject.on_completed()
+
+	def _packet(self, packet: tuple[int, int, int, bytes]):
+		self.received.on_next(packet)
+
+	def _message(self, name: str, value: Any):
+		getattr(self, name).on_next(value)
+
+	def _extra_disconnected(self):
+		self.disconnected.on_next(1)
+
+	async def close(self):
+		await super().close()
+		self.__finished()
+		self.disconnected.on_next(None)
+		self.disconnected.on_completed()
 
 class Serial(TypedDict):
 	chk_val: int
@@ -265,31 +721,60 @@ class Serial(TypedDict):
 	serial: str
 	cpu_id: str
 
+#  Incremental frame reassembly.  Received bytes are appended to one reusable
+#  buffer, the reader jumps straight to the next 0xAA 0x02 sync marker, checks
+#  the header CRC8 and frame CRC16 in place and drops everything it consumed
+#  once per feed() rather than copying the buffer for every frame or skipped
+#  byte.  Only the frames that are handed out are copied.
+class FrameReader:
+
+	def __init__(self):
+		self.__buf = bytearray()
+
+	def reset(self):
+		self.__buf.clear()
+
+	def feed(self, data: bytes) -> list[bytes]:
+		buf = self.__buf
+		buf += data
+		end = len(buf)
+		pos = 0
+		frames = []
+		with memoryview(buf) as view:
+			while end - pos >= 18:
+				if buf[pos] != 0xAA or buf[pos + 1] != 0x02:
+					pos = buf.find(b'\xaa\x02', pos + 1)
+					if pos < 0:
+						#  Keep a trailing 0xAA, it may be the first half of a sync marker
+						pos = end - 1 if buf[end - 1] == 0xAA else end
+						break
+					continue
+				size = buf[pos + 2] | (buf[pos + 3] << 8)
+				if pos + 18 + size > end:
+					break
+				if _crc8(view[pos:pos + 4]) != buf[pos + 4]:
+					pos += 2
+					continue
+				if _crc16(view[pos:pos + 16 + size]) != buf[pos + 16 + size] | (buf[pos + 17 + size] << 8):
+					pos += 2
+					continue
+				frames.append(bytes(view[pos:pos + 18 + size]))
+				pos += 18 + size
+		if pos:
+			del buf[:pos]
+		return frames
+
+
 def _merge_packet(obs: Observable[Optional[bytes]]):
 	def func(sub: Observer[bytes], sched=None):
-		x = b''
+		reader = FrameReader()
 
 		def next(rcv: Optional[bytes]):
-			nonlocal x
 			if rcv is None:
-				x = b''
+				reader.reset()
 				return
-			x += rcv
-			while len(x) >= 18:
-				if x[:2] != b'\xaa\x02':
-					x = x[1:]
-					continue
-				size = int.from_bytes(x[2:4], 'little')
-				if 18 + size > len(x):
-					return
-				if calcCrc8(x[:4]) != x[4:5]:
-					x = x[2:]
-					continue
-				if calcCrc16(x[:16 + size]) != x[16 + size:18 + size]:
-					x = x[2:]
-					continue
-				sub.on_next(x[:18 + size])
-				x = x[18 + size:]
+			for frame in reader.feed(rcv):
+				sub.on_next(frame)
 
 		return obs.subscribe(next, sub.on_error, sub.on_completed, scheduler=sched)
 
@@ -309,6 +794,92 @@ def _parse_dict(d: bytes, types: Iterable[tuple[str, int, Callable[[bytes], Any]
 	return res
 
 
+#  A _parse_dict field list compiled once into a struct.Struct.  Ints, floats
+#  and scaled ints are unpacked by the one unpack_from() call, fields with any
+#  other converter are unpacked as raw bytes and converted afterwards along with
+#  the divisors.  Versions and durations hardly ever change between frames, so
+#  their string conversions are memoized.  Payloads shorter than the layout go
+#  through _parse_dict so a truncated frame decodes exactly as it always has.
+class _Layout:
+
+	def __init__(self, fields: list[tuple[str, int, Callable[[bytes], Any]]]):
+		self.fields = fields
+		self.names = list[str]()
+		self.post = list[tuple[str, Callable[[Any], Any]]]()
+		fmt = "<"
+		for (name, size, fn) in fields:
+			if name is None:
+				fmt += f"{size}x"
+				continue
+			div = getattr(fn, "div", None)
+			if fn is _to_float and size == 4:
+				fmt += "f"
+			elif (fn is _to_int or div is not None) and size in _INT_CODES:
+				fmt += _INT_CODES[size]
+				if div is not None:
+					self.post.append((name, _divide(div)))
+			else:
+				fmt += f"{size}s"
+				if fn in _MEMOIZE:
+					fn = functools.lru_cache(maxsize=256)(fn)
+				self.post.append((name, fn))
+			self.names.append(name)
+		self.struct = struct.Struct(fmt)
+		self.size = self.struct.size
+		self.__projections = dict[frozenset[str], _Layout]()
+
+	#  The layout that decodes only "names", every other field is skipped over
+	#  as padding.  None means every field.
+	def project(self, names: Optional[Iterable[str]]):
+		if names is None:
+			return self
+		key = frozenset(names)
+		layout = self.__projections.get(key)
+		if layout is None:
+			layout = _Layout([f if f[0] in key else (None, f[1], None) for f in self.fields])
+			self.__projections[key] = layout
+		return layout
+
+	def parse(self, d: bytes) -> dict[str, Any]:
+		if len(d) < self.size:
+			return _parse_dict(d, self.fields)
+		res = dict(zip(self.names, self.struct.unpack_from(d)))
+		for (name, fn) in self.post:
+			res[name] = fn(res[name])
+		return res
+
+	#  The inverse of parse(), for synthesizing frames in tests and benchmarks.
+	#  "values" maps field names to decoded values, missing fields are zero.
+	#  Durations are given as a number of minutes or seconds, as on the wire.
+	def pack(self, values: dict[str, Any]) -> bytes:
+		args = []
+		for (name, size, fn) in self.fields:
+			if name is None:
+				continue
+			value = values.get(name, 0)
+			div = getattr(fn, "div", None)
+			if fn is _to_float and size == 4:
+				args.append(float(value))
+			elif (fn is _to_int or div is not None) and size in _INT_CODES:
+				args.append(round(value * (div or 1)))
+			elif isinstance(value, (bytes, list, tuple)):
+				args.append(bytes(value))
+			elif fn is _to_utf8:
+				args.append(str(value or "").encode())
+			elif fn is _to_ver_reversed and isinstance(value, str):
+				args.append(bytes(reversed([int(i) for i in value.split(".")])))
+			else:
+				args.append(int(value).to_bytes(size, "little"))
+		return self.struct.pack(*args)
+
+
+_INT_CODES = {1: "B", 2: "H", 4: "I", 8: "Q"}
+
+
+def _divide(div: int):
+	return lambda v: v / div
+
+
 def _to_float(d: bytes) -> float:
 	return struct.unpack("<f", d)[0]
 
@@ -324,6 +895,7 @@ def _to_int_ex(div: int = 1):
 			return None
 		v /= div
 		return v
+	f.div = div
 	return f
 
 
@@ -350,12 +922,28 @@ def _to_ver_reversed(data: Iterable[int]):
 	return _to_ver(reversed(data))
 
 
+#  Converters that return immutable values and are safe for _Layout to memoize
+_MEMOIZE = {_to_timedelta_min, _to_timedelta_sec, _to_utf8, _to_ver_reversed}
+
+
+#  bytes.translate() tables that XOR every byte with one of the 256 keys, so a
+#  whole payload is deobfuscated in C.  Built the first time a key is seen.
+_xor_tabs = [None] * 256
+
+
+def _deobfuscate(args: bytes, key: int):
+	tab = _xor_tabs[key]
+	if tab is None:
+		tab = _xor_tabs[key] = bytes(i ^ key for i in range(256))
+	return args.translate(tab)
+
+
 def decode_packet(x: bytes):
 	size = int.from_bytes(x[2:4], 'little')
 	args = x[16:16 + size]
 	if ((x[5] >> 5) & 3) == 1:
 		# Deobfuscation
-		args = bytes(v ^ x[6] for v in args)
+		args = _deobfuscate(args, x[6])
 	return (x[12], x[14], x[15], args)
 
 
@@ -403,64 +991,72 @@ def is_serial_extra(x: tuple[int, int, int]):
 	return x[0:3] == (6, 1, 65)
 
 
-def parse_bms(d: bytes, product: int):
+def parse_bms(d: bytes, product: int, fields: Optional[Iterable[str]] = None):
 	if is_delta(product):
-		return parse_bms_delta(d)
+		return parse_bms_delta(d, fields)
 	if is_river(product):
-		return parse_bms_river(d)
+		return parse_bms_river(d, fields)
 	return (0, {})
 
 
-def parse_bms_delta(d: bytes):
-	val = _parse_dict(d, [
-		("num", 1, _to_int),
-		("battery_type", 1, _to_int),
-		("battery_cell_id", 1, _to_int),
-		("battery_error", 4, _to_int),
-		("battery_version", 4, _to_ver_reversed),
-		("battery_level", 1, _to_int),
-		("battery_voltage", 4, _to_int_ex(div=1000)),
-		("battery_current", 4, _to_int),
-		("battery_temp", 1, _to_int),
-		("_open_bms_idx", 1, _to_int),
-		("battery_capacity_design", 4, _to_int),
-		("battery_capacity_remain", 4, _to_int),
-		("battery_capacity_full", 4, _to_int),
-		("battery_cycles", 4, _to_int),
-		("_soh", 1, _to_int),
-		("battery_voltage_max", 2, _to_int_ex(div=1000)),
-		("battery_voltage_min", 2, _to_int_ex(div=1000)),
-		("battery_temp_max", 1, _to_int),
-		("battery_temp_min", 1, _to_int),
-		("battery_mos_temp_max", 1, _to_int),
-		("battery_mos_temp_min", 1, _to_int),
-		("battery_fault", 1, _to_int),
-		("_sys_stat_reg", 1, _to_int),
-		("_tag_chg_current", 4, _to_int),
-		("battery_level_f32", 4, _to_float),
-		("battery_in_power", 4, _to_int),
-		("battery_out_power", 4, _to_int),
-		("battery_remain", 4, _to_timedelta_min),
-	])
+_bms_delta_layout = _Layout([
+	("num", 1, _to_int),
+	("battery_type", 1, _to_int),
+	("battery_cell_id", 1, _to_int),
+	("battery_error", 4, _to_int),
+	("battery_version", 4, _to_ver_reversed),
+	("battery_level", 1, _to_int),
+	("battery_voltage", 4, _to_int_ex(div=1000)),
+	("battery_current", 4, _to_int),
+	("battery_temp", 1, _to_int),
+	("_open_bms_idx", 1, _to_int),
+	("battery_capacity_design", 4, _to_int),
+	("battery_capacity_remain", 4, _to_int),
+	("battery_capacity_full", 4, _to_int),
+	("battery_cycles", 4, _to_int),
+	("_soh", 1, _to_int),
+	("battery_voltage_max", 2, _to_int_ex(div=1000)),
+	("battery_voltage_min", 2, _to_int_ex(div=1000)),
+	("battery_temp_max", 1, _to_int),
+	("battery_temp_min", 1, _to_int),
+	("battery_mos_temp_max", 1, _to_int),
+	("battery_mos_temp_min", 1, _to_int),
+	("battery_fault", 1, _to_int),
+	("_sys_stat_reg", 1, _to_int),
+	("_tag_chg_current", 4, _to_int),
+	("battery_level_f32", 4, _to_float),
+	("battery_in_power", 4, _to_int),
+	("battery_out_power", 4, _to_int),
+	("battery_remain", 4, _to_timedelta_min),
+])
+
+
+def parse_bms_delta(d: bytes, fields: Optional[Iterable[str]] = None):
+	if fields is not None:
+		fields = ("num", *fields)
+	val = _bms_delta_layout.project(fields).parse(d)
 	return (cast(int, val.pop("num")), val)
 
 
-def parse_bms_river(d: bytes):
-	return (1, _parse_dict(d, [
-		("battery_error", 4, _to_int),
-		("battery_version", 4, _to_ver_reversed),
-		("battery_level", 1, _to_int),
-		("battery_voltage", 4, _to_int_ex(div=1000)),
-		("battery_current", 4, _to_int),
-		("battery_temp", 1, _to_int),
-		("battery_capacity_remain", 4, _to_int),
-		("battery_capacity_full", 4, _to_int),
-		("battery_cycles", 4, _to_int),
-		("ambient_mode", 1, _to_int),
-		("ambient_animate", 1, _to_int),
-		("ambient_color", 4, list),
-		("ambient_brightness", 1, _to_int),
-	]))
+_bms_river_layout = _Layout([
+	("battery_error", 4, _to_int),
+	("battery_version", 4, _to_ver_reversed),
+	("battery_level", 1, _to_int),
+	("battery_voltage", 4, _to_int_ex(div=1000)),
+	("battery_current", 4, _to_int),
+	("battery_temp", 1, _to_int),
+	("battery_capacity_remain", 4, _to_int),
+	("battery_capacity_full", 4, _to_int),
+	("battery_cycles", 4, _to_int),
+	("ambient_mode", 1, _to_int),
+	("ambient_animate", 1, _to_int),
+	("ambient_color", 4, list),
+	("ambient_brightness", 1, _to_int),
+])
+
+
+def parse_bms_river(d: bytes, fields: Optional[Iterable[str]] = None):
+	return (1, _bms_river_layout.project(fields).parse(d))
 
 
 def parse_dc_in_current_config(d: bytes):
@@ -471,67 +1067,73 @@ def parse_dc_in_type(d: bytes):
 	return d[1]
 
 
-def parse_ems(d: bytes, product: int):
+def parse_ems(d: bytes, product: int, fields: Optional[Iterable[str]] = None):
 	if is_delta(product):
-		return parse_ems_delta(d)
+		return parse_ems_delta(d, fields)
 	if is_river(product):
-		return parse_ems_river(d)
+		return parse_ems_river(d, fields)
 	# if is_river_mini(product):
 	#     return parse_ems_river_mini(d)
 	return {}
 
 
-def parse_ems_delta(d: bytes):
-	return _parse_dict(d, [
-		("_state_charge", 1, _to_int),
-		("_chg_cmd", 1, _to_int),
-		("_dsg_cmd", 1, _to_int),
-		("battery_main_voltage", 4, _to_int_ex(div=1000)),
-		("battery_main_current", 4, _to_int_ex(div=1000)),
-		("_fan_level", 1, _to_int),
-		("battery_level_max", 1, _to_int),
-		("model", 1, _to_int),
-		("battery_main_level", 1, _to_int),
-		("_flag_open_ups", 1, _to_int),
-		("battery_main_warning", 1, _to_int),
-		("battery_remain_charge", 4, _to_timedelta_min),
-		("battery_remain_discharge", 4, _to_timedelta_min),
-		("battery_main_normal", 1, _to_int),
-		("battery_main_level_f32", 4, _to_float),
-		("_is_connect", 3, _to_int),
-		("_max_available_num", 1, _to_int),
-		("_open_bms_idx", 1, _to_int),
-		("battery_main_voltage_min", 4, _to_int_ex(div=1000)),
-		("battery_main_voltage_max", 4, _to_int_ex(div=1000)),
-		("battery_level_min", 1, _to_int),
-		("generator_level_start", 1, _to_int),
-		("generator_level_stop", 1, _to_int),
-	])
-
-
-def parse_ems_river(d: bytes):
-	return _parse_dict(d, [
-		("battery_main_error", 4, _to_int),
-		("battery_main_version", 4, _to_ver_reversed),
-		("battery_main_level", 1, _to_int),
-		("battery_main_voltage", 4, _to_int_ex(div=1000)),
-		("battery_main_current", 4, _to_int),
-		("battery_main_temp", 1, _to_int),
-		("_open_bms_idx", 1, _to_int),
-		("battery_capacity_remain", 4, _to_int),
-		("battery_capacity_full", 4, _to_int),
-		("battery_cycles", 4, _to_int),
-		("battery_level_max", 1, _to_int),
-		("battery_main_voltage_max", 2, _to_int_ex(div=1000)),
-		("battery_main_voltage_min", 2, _to_int_ex(div=1000)),
-		("battery_main_temp_max", 1, _to_int),
-		("battery_main_temp_min", 1, _to_int),
-		("mos_temp_max", 1, _to_int),
-		("mos_temp_min", 1, _to_int),
-		("battery_main_fault", 1, _to_int),
-		("_bq_sys_stat_reg", 1, _to_int),
-		("_tag_chg_amp", 4, _to_int),
-	])
+_ems_delta_layout = _Layout([
+	("_state_charge", 1, _to_int),
+	("_chg_cmd", 1, _to_int),
+	("_dsg_cmd", 1, _to_int),
+	("battery_main_voltage", 4, _to_int_ex(div=1000)),
+	("battery_main_current", 4, _to_int_ex(div=1000)),
+	("_fan_level", 1, _to_int),
+	("battery_level_max", 1, _to_int),
+	("model", 1, _to_int),
+	("battery_main_level", 1, _to_int),
+	("_flag_open_ups", 1, _to_int),
+	("battery_main_warning", 1, _to_int),
+	("battery_remain_charge", 4, _to_timedelta_min),
+	("battery_remain_discharge", 4, _to_timedelta_min),
+	("battery_main_normal", 1, _to_int),
+	("battery_main_level_f32", 4, _to_float),
+	("_is_connect", 3, _to_int),
+	("_max_available_num", 1, _to_int),
+	("_open_bms_idx", 1, _to_int),
+	("battery_main_voltage_min", 4, _to_int_ex(div=1000)),
+	("battery_main_voltage_max", 4, _to_int_ex(div=1000)),
+	("battery_level_min", 1, _to_int),
+	("generator_level_start", 1, _to_int),
+	("generator_level_stop", 1, _to_int),
+])
+
+
+def parse_ems_delta(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _ems_delta_layout.project(fields).parse(d)
+
+
+_ems_river_layout = _Layout([
+	("battery_main_error", 4, _to_int),
+	("battery_main_version", 4, _to_ver_reversed),
+	("battery_main_level", 1, _to_int),
+	("battery_main_voltage", 4, _to_int_ex(div=1000)),
+	("battery_main_current", 4, _to_int),
+	("battery_main_temp", 1, _to_int),
+	("_open_bms_idx", 1, _to_int),
+	("battery_capacity_remain", 4, _to_int),
+	("battery_capacity_full", 4, _to_int),
+	("battery_cycles", 4, _to_int),
+	("battery_level_max", 1, _to_int),
+	("battery_main_voltage_max", 2, _to_int_ex(div=1000)),
+	("battery_main_voltage_min", 2, _to_int_ex(div=1000)),
+	("battery_main_temp_max", 1, _to_int),
+	("battery_main_temp_min", 1, _to_int),
+	("mos_temp_max", 1, _to_int),
+	("mos_temp_min", 1, _to_int),
+	("battery_main_fault", 1, _to_int),
+	("_bq_sys_stat_reg", 1, _to_int),
+	("_tag_chg_amp", 4, _to_int),
+])
+
+
+def parse_ems_river(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _ems_river_layout.project(fields).parse(d)
 
 
 # def parse_ems_river_mini(d: bytes):
@@ -541,208 +1143,223 @@ def parse_fan_auto(d: bytes):
 	return d[0] == 1
 
 
-def parse_inverter(d: bytes, product: int):
+def parse_inverter(d: bytes, product: int, fields: Optional[Iterable[str]] = None):
 	if is_delta(product):
-		return parse_inverter_delta(d)
+		return parse_inverter_delta(d, fields)
 	if is_river(product):
-		return parse_inverter_river(d)
+		return parse_inverter_river(d, fields)
 	# if is_river_mini(product):
 	#     return parse_pd_river_mini(d)
 	return {}
 
 
-def parse_inverter_delta(d: bytes):
-	return _parse_dict(d, [
-		("ac_error", 4, _to_int),
-		("ac_version", 4, _to_ver_reversed),
-		("ac_in_type", 1, _to_int),
-		("ac_in_power", 2, _to_int),
-		("ac_out_power", 2, _to_int),
-		("ac_type", 1, _to_int),
-		("ac_out_voltage", 4, _to_int_ex(div=1000)),
-		("ac_out_current", 4, _to_int_ex(div=1000)),
-		("ac_out_freq", 1, _to_int),
-		("ac_in_voltage", 4, _to_int_ex(div=1000)),
-		("ac_in_current", 4, _to_int_ex(div=1000)),
-		("ac_in_freq", 1, _to_int),
-		("ac_out_temp", 2, _to_int),
-		("dc_in_voltage", 4, _to_int),
-		("dc_in_current", 4, _to_int),
-		("ac_in_temp", 2, _to_int),
-		("fan_state", 1, _to_int),
-		("ac_out_state", 1, _to_int),
-		("ac_out_xboost", 1, _to_int),
-		("ac_out_voltage_config", 4, _to_int_ex(div=1000)),
-		("ac_out_freq_config", 1, _to_int),
-		("fan_config", 1, _to_int),
-		("ac_in_pause", 1, _to_int),
-		("ac_in_limit_switch", 1, _to_int),
-		("ac_in_limit_max", 2, _to_int),
-		("ac_in_limit_custom", 2, _to_int),
-		("ac_out_timeout", 2, _to_int),
-	])
-
-
-def parse_inverter_river(d: bytes):
-	return _parse_dict(d, [
-		("ac_error", 4, _to_int),
-		("ac_version", 4, _to_ver_reversed),
-		("in_type", 1, _to_int),
-		("in_power", 2, _to_int),
-		("ac_out_power", 2, _to_int),
-		("ac_type", 1, _to_int),
-		("ac_out_voltage", 4, _to_int_ex(div=1000)),
-		("ac_out_current", 4, _to_int_ex(div=1000)),
-		("ac_out_freq", 1, _to_int),
-		("ac_in_voltage", 4, _to_int_ex(div=1000)),
-		("ac_in_current", 4, _to_int_ex(div=1000)),
-		("ac_in_freq", 1, _to_int),
-		("ac_out_temp", 1, _to_int),
-		("dc_in_voltage", 4, _to_int_ex(div=1000)),
-		("dc_in_current", 4, _to_int_ex(div=1000)),
-		("ac_in_temp", 1, _to_int),
-		("fan_state", 1, _to_int),
-		("ac_out_state", 1, _to_int),
-		("ac_out_xboost", 1, _to_int),
-		("ac_out_voltage_config", 4, _to_int_ex(div=1000)),
-		("ac_out_freq_config", 1, _to_int),
-		("ac_in_slow", 1, _to_int),
-		("ac_out_timeout", 2, _to_int),
-		("fan_config", 1, _to_int),
-	])
+_inverter_delta_layout = _Layout([
+	("ac_error", 4, _to_int),
+	("ac_version", 4, _to_ver_reversed),
+	("ac_in_type", 1, _to_int),
+	("ac_in_power", 2, _to_int),
+	("ac_out_power", 2, _to_int),
+	("ac_type", 1, _to_int),
+	("ac_out_voltage", 4, _to_int_ex(div=1000)),
+	("ac_out_current", 4, _to_int_ex(div=1000)),
+	("ac_out_freq", 1, _to_int),
+	("ac_in_voltage", 4, _to_int_ex(div=1000)),
+	("ac_in_current", 4, _to_int_ex(div=1000)),
+	("ac_in_freq", 1, _to_int),
+	("ac_out_temp", 2, _to_int),
+	("dc_in_voltage", 4, _to_int),
+	("dc_in_current", 4, _to_int),
+	("ac_in_temp", 2, _to_int),
+	("fan_state", 1, _to_int),
+	("ac_out_state", 1, _to_int),
+	("ac_out_xboost", 1, _to_int),
+	("ac_out_voltage_config", 4, _to_int_ex(div=1000)),
+	("ac_out_freq_config", 1, _to_int),
+	("fan_config", 1, _to_int),
+	("ac_in_pause", 1, _to_int),
+	("ac_in_limit_switch", 1, _to_int),
+	("ac_in_limit_max", 2, _to_int),
+	("ac_in_limit_custom", 2, _to_int),
+	("ac_out_timeout", 2, _to_int),
+])
+
+
+def parse_inverter_delta(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _inverter_delta_layout.project(fields).parse(d)
+
+
+_inverter_river_layout = _Layout([
+	("ac_error", 4, _to_int),
+	("ac_version", 4, _to_ver_reversed),
+	("in_type", 1, _to_int),
+	("in_power", 2, _to_int),
+	("ac_out_power", 2, _to_int),
+	("ac_type", 1, _to_int),
+	("ac_out_voltage", 4, _to_int_ex(div=1000)),
+	("ac_out_current", 4, _to_int_ex(div=1000)),
+	("ac_out_freq", 1, _to_int),
+	("ac_in_voltage", 4, _to_int_ex(div=1000)),
+	("ac_in_current", 4, _to_int_ex(div=1000)),
+	("ac_in_freq", 1, _to_int),
+	("ac_out_temp", 1, _to_int),
+	("dc_in_voltage", 4, _to_int_ex(div=1000)),
+	("dc_in_current", 4, _to_int_ex(div=1000)),
+	("ac_in_temp", 1, _to_int),
+	("fan_state", 1, _to_int),
+	("ac_out_state", 1, _to_int),
+	("ac_out_xboost", 1, _to_int),
+	("ac_out_voltage_config", 4, _to_int_ex(div=1000)),
+	("ac_out_freq_config", 1, _to_int),
+	("ac_in_slow", 1, _to_int),
+	("ac_out_timeout", 2, _to_int),
+	("fan_config", 1, _to_int),
+])
+
+
+def parse_inverter_river(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _inverter_river_layout.project(fields).parse(d)
 
 
 def parse_lcd_timeout(d: bytes):
 	return int.from_bytes(d[1:3], "little")
 
 
-def parse_mppt(d: bytes, product: int):
+def parse_mppt(d: bytes, product: int, fields: Optional[Iterable[str]] = None):
 	if is_delta(product):
-		return parse_mppt_delta(d)
+		return parse_mppt_delta(d, fields)
 	return {}
 
 
-def parse_mppt_delta(d: bytes):
-	return _parse_dict(d, [
-		("dc_in_error", 4, _to_int),
-		("dc_in_version", 4, _to_ver_reversed),
-		("dc_in_voltage", 4, _to_int_ex(div=10)),
-		("dc_in_current", 4, _to_int_ex(div=100)),
-		("dc_in_power", 2, _to_int_ex(div=10)),
-		("_volt_?_out", 4, _to_int),
-		("_curr_?_out", 4, _to_int),
-		("_watts_?_out", 2, _to_int),
-		("dc_in_temp", 2, _to_int),
-		("dc_in_type", 1, _to_int),
-		("dc_in_type_config", 1, _to_int),
-		("_dc_in_type", 1, _to_int),
-		("dc_in_state", 1, _to_int),
-		("anderson_out_voltage", 4, _to_int),
-		("anderson_out_current", 4, _to_int),
-		("anderson_out_power", 2, _to_int),
-		("car_out_voltage", 4, _to_int_ex(div=10)),
-		("car_out_current", 4, _to_int_ex(div=100)),
-		("car_out_power", 2, _to_int_ex(div=10)),
-		("car_out_temp", 2, _to_int),
-		("car_out_state", 1, _to_int),
-		("dc24_temp", 2, _to_int),
-		("dc24_state", 1, _to_int),
-		("dc_in_pause", 1, _to_int),
-		("_dc_in_switch", 1, _to_int),
-		("_dc_in_limit_max", 2, _to_int),
-		("_dc_in_limit_custom", 2, _to_int),
-	])
-
-
-def parse_pd(d: bytes, product: int):
+_mppt_delta_layout = _Layout([
+	("dc_in_error", 4, _to_int),
+	("dc_in_version", 4, _to_ver_reversed),
+	("dc_in_voltage", 4, _to_int_ex(div=10)),
+	("dc_in_current", 4, _to_int_ex(div=100)),
+	("dc_in_power", 2, _to_int_ex(div=10)),
+	("_volt_?_out", 4, _to_int),
+	("_curr_?_out", 4, _to_int),
+	("_watts_?_out", 2, _to_int),
+	("dc_in_temp", 2, _to_int),
+	("dc_in_type", 1, _to_int),
+	("dc_in_type_config", 1, _to_int),
+	("_dc_in_type", 1, _to_int),
+	("dc_in_state", 1, _to_int),
+	("anderson_out_voltage", 4, _to_int),
+	("anderson_out_current", 4, _to_int),
+	("anderson_out_power", 2, _to_int),
+	("car_out_voltage", 4, _to_int_ex(div=10)),
+	("car_out_current", 4, _to_int_ex(div=100)),
+	("car_out_power", 2, _to_int_ex(div=10)),
+	("car_out_temp", 2, _to_int),
+	("car_out_state", 1, _to_int),
+	("dc24_temp", 2, _to_int),
+	("dc24_state", 1, _to_int),
+	("dc_in_pause", 1, _to_int),
+	("_dc_in_switch", 1, _to_int),
+	("_dc_in_limit_max", 2, _to_int),
+	("_dc_in_limit_custom", 2, _to_int),
+])
+
+
+def parse_mppt_delta(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _mppt_delta_layout.project(fields).parse(d)
+
+
+def parse_pd(d: bytes, product: int, fields: Optional[Iterable[str]] = None):
 	if is_delta(product):
-		return parse_pd_delta(d)
+		return parse_pd_delta(d, fields)
 	if is_river(product):
-		return parse_pd_river(d)
+		return parse_pd_river(d, fields)
 	# if is_river_mini(product):
 	#     return parse_pd_river_mini(d)
 	return {}
 
 
-def parse_pd_delta(d: bytes):
-	return _parse_dict(d, [
-		("model", 1, _to_int),
-		("pd_error", 4, _to_int),
-		("pd_version", 4, _to_ver_reversed),
-		("wifi_version", 4, _to_ver_reversed),
-		("wifi_autorecovery", 1, _to_int),
-		("battery_level", 1, _to_int),
-		("out_power", 2, _to_int),
-		("in_power", 2, _to_int),
-		("remain_display", 4, _to_timedelta_min),
-		("beep", 1, _to_int),
-		("_watts_anderson_out", 1, _to_int),
-		("usb_out1_power", 1, _to_int),
-		("usb_out2_power", 1, _to_int),
-		("usbqc_out1_power", 1, _to_int),
-		("usbqc_out2_power", 1, _to_int),
-		("typec_out1_power", 1, _to_int),
-		("typec_out2_power", 1, _to_int),
-		("typec_out1_temp", 1, _to_int),
-		("typec_out2_temp", 1, _to_int),
-		("car_out_state", 1, _to_int),
-		("car_out_power", 1, _to_int),
-		("car_out_temp", 1, _to_int),
-		("standby_timeout", 2, _to_int),
-		("lcd_timeout", 2, _to_int),
-		("lcd_brightness", 1, _to_int),
-		("car_in_energy", 4, _to_int),
-		("mppt_in_energy", 4, _to_int),
-		("ac_in_energy", 4, _to_int),
-		("car_out_energy", 4, _to_int),
-		("ac_out_energy", 4, _to_int),
-		("usb_time", 4, _to_timedelta_sec),
-		("typec_time", 4, _to_timedelta_sec),
-		("car_out_time", 4, _to_timedelta_sec),
-		("ac_out_time", 4, _to_timedelta_sec),
-		("ac_in_time", 4, _to_timedelta_sec),
-		("car_in_time", 4, _to_timedelta_sec),
-		("mppt_time", 4, _to_timedelta_sec),
-		(None, 2, None),
-		("_ext_rj45", 1, _to_int),
-		("_ext_infinity", 1, _to_int),
-	])
-
-
-def parse_pd_river(d: bytes):
-	return _parse_dict(d, [
-		("model", 1, _to_int),
-		("pd_error", 4, _to_int),
-		("pd_version", 4, _to_ver_reversed),
-		("battery_level", 1, _to_int),
-		("out_power", 2, _to_int),
-		("in_power", 2, _to_int),
-		("remain_display", 4, _to_timedelta_min),
-		("car_out_state", 1, _to_int),
-		("light_state", 1, _to_int),
-		("beep", 1, _to_int),
-		("typec_out1_power", 1, _to_int),
-		("usb_out1_power", 1, _to_int),
-		("usb_out2_power", 1, _to_int),
-		("usbqc_out1_power", 1, _to_int),
-		("car_out_power", 1, _to_int),
-		("light_power", 1, _to_int),
-		("typec_out1_temp", 1, _to_int),
-		("car_out_temp", 1, _to_int),
-		("standby_timeout", 2, _to_int),
-		("car_in_energy", 4, _to_int),
-		("mppt_in_energy", 4, _to_int),
-		("ac_in_energy", 4, _to_int),
-		("car_out_energy", 4, _to_int),
-		("ac_out_energy", 4, _to_int),
-		("usb_time", 4, _to_timedelta_sec),
-		("usbqc_time", 4, _to_timedelta_sec),
-		("typec_time", 4, _to_timedelta_sec),
-		("car_out_time", 4, _to_timedelta_sec),
-		("ac_out_time", 4, _to_timedelta_sec),
-		("car_in_time", 4, _to_timedelta_sec),
-		("mppt_time", 4, _to_timedelta_sec),
-	])
+_pd_delta_layout = _Layout([
+	("model", 1, _to_int),
+	("pd_error", 4, _to_int),
+	("pd_version", 4, _to_ver_reversed),
+	("wifi_version", 4, _to_ver_reversed),
+	("wifi_autorecovery", 1, _to_int),
+	("battery_level", 1, _to_int),
+	("out_power", 2, _to_int),
+	("in_power", 2, _to_int),
+	("remain_display", 4, _to_timedelta_min),
+	("beep", 1, _to_int),
+	("_watts_anderson_out", 1, _to_int),
+	("usb_out1_power", 1, _to_int),
+	("usb_out2_power", 1, _to_int),
+	("usbqc_out1_power", 1, _to_int),
+	("usbqc_out2_power", 1, _to_int),
+	("typec_out1_power", 1, _to_int),
+	("typec_out2_power", 1, _to_int),
+	("typec_out1_temp", 1, _to_int),
+	("typec_out2_temp", 1, _to_int),
+	("car_out_state", 1, _to_int),
+	("car_out_power", 1, _to_int),
+	("car_out_temp", 1, _to_int),
+	("standby_timeout", 2, _to_int),
+	("lcd_timeout", 2, _to_int),
+	("lcd_brightness", 1, _to_int),
+	("car_in_energy", 4, _to_int),
+	("mppt_in_energy", 4, _to_int),
+	("ac_in_energy", 4, _to_int),
+	("car_out_energy", 4, _to_int),
+	("ac_out_energy", 4, _to_int),
+	("usb_time", 4, _to_timedelta_sec),
+	("typec_time", 4, _to_timedelta_sec),
+	("car_out_time", 4, _to_timedelta_sec),
+	("ac_out_time", 4, _to_timedelta_sec),
+	("ac_in_time", 4, _to_timedelta_sec),
+	("car_in_time", 4, _to_timedelta_sec),
+	("mppt_time", 4, _to_timedelta_sec),
+	(None, 2, None),
+	("_ext_rj45", 1, _to_int),
+	("_ext_infinity", 1, _to_int),
+])
+
+
+def parse_pd_delta(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _pd_delta_layout.project(fields).parse(d)
+
+
+_pd_river_layout = _Layout([
+	("model", 1, _to_int),
+	("pd_error", 4, _to_int),
+	("pd_version", 4, _to_ver_reversed),
+	("battery_level", 1, _to_int),
+	("out_power", 2, _to_int),
+	("in_power", 2, _to_int),
+	("remain_display", 4, _to_timedelta_min),
+	("car_out_state", 1, _to_int),
+	("light_state", 1, _to_int),
+	("beep", 1, _to_int),
+	("typec_out1_power", 1, _to_int),
+	("usb_out1_power", 1, _to_int),
+	("usb_out2_power", 1, _to_int),
+	("usbqc_out1_power", 1, _to_int),
+	("car_out_power", 1, _to_int),
+	("light_power", 1, _to_int),
+	("typec_out1_temp", 1, _to_int),
+	("car_out_temp", 1, _to_int),
+	("standby_timeout", 2, _to_int),
+	("car_in_energy", 4, _to_int),
+	("mppt_in_energy", 4, _to_int),
+	("ac_in_energy", 4, _to_int),
+	("car_out_energy", 4, _to_int),
+	("ac_out_energy", 4, _to_int),
+	("usb_time", 4, _to_timedelta_sec),
+	("usbqc_time", 4, _to_timedelta_sec),
+	("typec_time", 4, _to_timedelta_sec),
+	("car_out_time", 4, _to_timedelta_sec),
+	("ac_out_time", 4, _to_timedelta_sec),
+	("car_in_time", 4, _to_timedelta_sec),
+	("mppt_time", 4, _to_timedelta_sec),
+])
+
+
+def parse_pd_river(d: bytes, fields: Optional[Iterable[str]] = None):
+	return _pd_river_layout.project(fields).parse(d)
 
 
 # def parse_pd_river_mini(d: bytes):
@@ -790,37 +1407,86 @@ def parse_pd_river(d: bytes):
 #     ])
 
 
+_serial_layout = _Layout([
+	("chk_val", 4, _to_int),
+	("product", 1, _to_int),
+	(None, 1, None),
+	("product_detail", 1, _to_int),
+	("model", 1, _to_int),
+	("serial", 15, _to_utf8),
+	(None, 1, None),
+	("cpu_id", 12, _to_utf8),
+])
+
+
 def parse_serial(d: bytes) -> Serial:
-	return _parse_dict(d, [
-		("chk_val", 4, _to_int),
-		("product", 1, _to_int),
-		(None, 1, None),
-		("product_detail", 1, _to_int),
-		("model", 1, _to_int),
-		("serial", 15, _to_utf8),
-		(None, 1, None),
-		("cpu_id", 12, _to_utf8),
-	])
+	return _serial_layout.parse(d)
 
 
 def merge_packet():
+	_import_rx()
 	return _merge_packet
 
 
 def calcCrc8(data: bytes):
+	return _crc8(data).to_bytes(1, "little")
+
+
+def calcCrc16(data: bytes):
+	return _crc16(data).to_bytes(2, "little")
+
+
+#  Fast CRC paths returning ints, used by FrameReader so that checking a frame
+#  doesn't allocate.  The CRC8 is only ever run over 4 byte headers, so it
+#  just iterates the bytes directly.  The CRC16 looks up whole 16 bit words.
+def _crc8(data: bytes) -> int:
+	crc = 0
+	tab = _crc8_tab
+	for b in data:
+		crc = tab[crc ^ b]
+	return crc
+
+
+def _crc16(data: bytes) -> int:
+	crc = 0
+	if len(data) < 16:
+		for b in data:
+			crc = _crc16_tab[(crc ^ b) & 255] ^ (crc >> 8)
+		return crc
+	tab = _crc16_tab2 or _build_crc16_tab2()
+	n = len(data) & ~1
+	if sys.byteorder == "little":
+		words = memoryview(data)[:n].cast("H")
+	else:
+		words = struct.unpack_from(f"<{n >> 1}H", data)
+	for w in words:
+		crc = tab[crc ^ w]
+	if n != len(data):
+		crc = _crc16_tab[(crc ^ data[n]) & 255] ^ (crc >> 8)
+	return crc
+
+
+#  The original byte at a time implementations, kept as the reference that
+#  the fast paths are checked against by ecoflow-bench.
+def _calcCrc8_ref(data: bytes):
 	crc = 0
 	for i3 in range(len(data)):
 		crc = _crc8_tab[(crc ^ data[i3]) & 255]
 	return crc.to_bytes(1, "little")
 
 
-def calcCrc16(data: bytes):
+def _calcCrc16_ref(data: bytes):
 	crc = 0
 	for i3 in range(len(data)):
 		crc = _crc16_tab[(crc ^ data[i3]) & 255] ^ (crc >> 8)
 	return crc.to_bytes(2, "little")
 
 
+#  The product number of a name in PRODUCTS
+def product_id(product_name: str) -> int:
+	return list(PRODUCTS.keys())[list(PRODUCTS.values()).index(product_name)]
+
+
 def get_model_name(product: int, model: int):
 	if product == 5 and model == 2:
 		return "RIVER Max"
@@ -887,6 +1553,22 @@ def build2(dst: int, cmd_set: int, cmd_id: int, data: bytes = b''):
     return b
 
 
+#  A frame as the device sends it, for ecoflow-bench and ecoflow-simulator:
+#  build2 always writes 32 (us) as the source, so swap in the device's source
+#  and our address, obfuscate the payload with "key" if there is one, and
+#  redo the CRC16
+def device_frame(src: int, cmd_set: int, cmd_id: int, payload: bytes, key: Optional[int] = None):
+    frame = bytearray(build2(32, cmd_set, cmd_id, payload))
+    frame[12] = src
+    frame[13] = 32
+    if key is not None:
+        frame[5] |= 1 << 5
+        frame[6] = key
+        frame[16:-2] = _deobfuscate(bytes(frame[16:-2]), key)
+    frame[-2:] = calcCrc16(frame[:-2])
+    return bytes(frame)
+
+
 def get_product_info(dst: int):
     return build2(dst, 1, 5)
 
@@ -1060,34 +1742,85 @@ def _set_watt(value: int):
     
 # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
 
+#  The sections a product reports, only the DELTA models have an mppt section
+def product_sections(product: int):
+	if is_delta(product):
+		return SECTIONS
+	return tuple(s for s in SECTIONS if s != "mppt")
+
+#  The sections that can be asked for, and the get command that asks for each
+#  one.  The others are only ever broadcast by the device.
+QUERIES = {
+	"pd": get_pd,
+	"ems": get_ems_main,
+	"inverter": get_inverter,
+}
+
 #  Get a JSON array of system information
-async def _get_status(product_name, ip_address, timeout_seconds):
+#
+#  Returns as soon as every one of "sections" (all of the sections the product
+#  reports by default) has arrived, or after "deadline" seconds.  If some
+#  sections did not arrive in time they are listed under the "missing" key.
+#  Returns an empty dict if nothing arrived at all.  See EcoFlowClient for
+#  "projection".  With "active" the sections in QUERIES are asked for instead
+#  of waiting for the device to send them, see EcoFlowClient.query().
+async def _get_status(product_name, ip_address, timeout_seconds, sections=None, deadline=5, projection=None, active=False):
+	client = None
 	try:
 		timeout = datetime.timedelta(seconds=timeout_seconds)
-		client =  EcoFlowClient(product_name, ip_address, timeout)
-		await asyncio.sleep(5)
-		#while "pd" not in client.diagnostics or "ems" not in client.diagnostics or "bms" not in client.diagnostics or "inverter" not in client.diagnostics or "mppt" not in client.diagnostics :
-		#	print('waiting')
-		#	await asyncio.sleep(0)
-		return client.diagnostics
+		client =  EcoFlowClient(product_name, ip_address, timeout, projection)
+		if sections is None:
+			sections = product_sections(client.product)
+		if active:
+			(status, missing) = await client.query(sections, deadline)
+		else:
+			missing = await client.wait_for(sections, deadline)
+			status = dict(client.diagnostics)
+		if status and missing:
+			_LOGGER.warning(f"{ip_address} did not send {', '.join(missing)} within {deadline} seconds")
+			status["missing"] = missing
+		return status
 	finally:
 		if client:
 			await client.close()
 
-def get_status(product_name, ip_address, timeout_seconds):
-	return asyncio.run(_get_status(product_name, ip_address, timeout_seconds))
+def get_status(product_name, ip_address, timeout_seconds, sections=None, deadline=5, projection=None, active=False):
+	return asyncio.run(_get_status(product_name, ip_address, timeout_seconds, sections, deadline, projection, active))
+
+#  Get the status of several devices in one event loop.  "devices" is a list of
+#  dicts with (at least) "product_name" and "ip_address".  At most
+#  "concurrency" devices are connected at once, each one gets its own
+#  "deadline" as in get_status.  Returns the statuses in the same order, with
+#  an empty dict for any device that failed.
+async def _get_statuses(devices, timeout_seconds, sections=None, deadline=5, projection=None, concurrency=16, active=False):
+	semaphore = asyncio.Semaphore(concurrency)
+
+	async def one(device):
+		async with semaphore:
+			try:
+				return await _get_status(device["product_name"], device["ip_address"], timeout_seconds, sections, deadline, projection, active)
+			except Exception:
+				_LOGGER.exception(f"unable to get the status of {device['ip_address']}")
+				return {}
+
+	return await asyncio.gather(*(one(device) for device in devices))
+
+def get_statuses(devices, timeout_seconds, sections=None, deadline=5, projection=None, concurrency=16, active=False):
+	return asyncio.run(_get_statuses(devices, timeout_seconds, sections, deadline, projection, concurrency, active))
 
-#  Send one of the get/set commands from the "send.py" portion of the API
-async def _set_config(product_name, ip_address, timeout_seconds, parameter):
+#  Send get/set commands from the "send.py" portion of the API, back to back
+#  over one connection.  Returns once they have been written, raises
+#  asyncio.TimeoutError if that doesn't happen within "timeout_seconds".
+async def _set_config(product_name, ip_address, timeout_seconds, *parameters):
+	client = None
 	try:
 		timeout = datetime.timedelta(seconds=timeout_seconds)
 		client =  EcoFlowClient(product_name, ip_address, timeout)
-		while not client.diagnostics:
-			await asyncio.sleep(0)
-		return client.tcp.write(parameter)
+		client.send(*parameters)
+		await client.drain(timeout_seconds)
 	finally:
 		if client:
 			await client.close()
 
-def set_config(product_name, ip_address, timeout_seconds, parameter):
-	return asyncio.run(_set_config(product_name, ip_address, timeout_seconds, parameter))
+def set_config(product_name, ip_address, timeout_seconds, *parameters):
+	return asyncio.run(_set_config(product_name, ip_address, timeout_seconds, *parameters))
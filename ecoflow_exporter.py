@@ -0,0 +1,230 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  MIT License
+#
+#  Copyright (C) 2023  David King <dave@daveking.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Serves the latest EcoFlowClient.diagnostics of every device, straight from
+#  memory, in the Prometheus text format or OpenMetrics (if the scraper asks
+#  for it):
+#
+#     exporter = Exporter()
+#     exporter.add_client("delta-pro", client)
+#     await exporter.start("", 9455)
+#
+#  Every numeric field is a gauge named ecoflow_<section>_<field> with a
+#  "device" label, and a "pack" label for the bms fields.  The fields the
+#  parsers name with a leading underscore aren't understood and are left out.
+#  The connection statistics and message counts of each client are exported
+#  too, and add_collector() adds anything else, like the logger's counters.
+#
+#  The HTTP server runs on the same event loop as the clients, so a scrape
+#  sees one consistent set of values without any locking.  It only formats
+#  what is already in memory, at most once every "cache_seconds" however
+#  often it is scraped.
+
+from __future__ import annotations
+from typing import Any, Callable, Iterable, Iterator, Optional
+import asyncio
+import logging
+import math
+import re
+import time
+
+import ecoflow
+
+_LOGGER = logging.getLogger(__name__)
+
+#  (name, type, help, [(labels, value)]), what a collector returns a list of.
+#  "type" is "gauge" or "counter", a counter's name doesn't end in _total.
+Family = tuple[str, str, str, list[tuple[dict[str, str], float]]]
+
+OPENMETRICS = "application/openmetrics-text; version=1.0.0; charset=utf-8"
+PROMETHEUS = "text/plain; version=0.0.4; charset=utf-8"
+
+_INVALID = re.compile(r"[^a-zA-Z0-9_]")
+
+
+def _name(name: str):
+	return _INVALID.sub("_", name)
+
+
+def _label(value: str):
+	return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _value(value: float):
+	if isinstance(value, bool):
+		return "1" if value else "0"
+	if isinstance(value, int):
+		return str(value)
+	if math.isnan(value):
+		return "NaN"
+	if math.isinf(value):
+		return "+Inf" if value > 0 else "-Inf"
+	return repr(float(value))
+
+
+def _fields(fields: dict[str, Any]) -> Iterator[tuple[str, Any]]:
+	for (name, value) in fields.items():
+		if not name.startswith("_") and isinstance(value, (int, float)):
+			yield (name, value)
+
+
+#  The diagnostics of one client as gauges, added to "families"
+def _diagnostics(families: dict[str, Family], device: str, diagnostics: dict[str, Any]):
+	for (section, fields) in diagnostics.items():
+		if not isinstance(fields, dict):
+			continue
+		if section == "bms":
+			for (pack, pack_fields) in fields.items():
+				labels = {"device": device, "pack": str(pack)}
+				for (name, value) in _fields(pack_fields):
+					_add(families, f"ecoflow_bms_{name}", "gauge", f"bms {name}", labels, value)
+		else:
+			labels = {"device": device}
+			for (name, value) in _fields(fields):
+				_add(families, f"ecoflow_{section}_{name}", "gauge", f"{section} {name}", labels, value)
+
+
+def _add(families: dict[str, Family], name: str, kind: str, help: str, labels: dict[str, str], value: float):
+	name = _name(name)
+	family = families.get(name)
+	if family is None:
+		family = families[name] = (name, kind, help, [])
+	family[3].append((labels, value))
+
+
+#  The connection statistics and message counts of one client
+def _client(families: dict[str, Family], device: str, client: ecoflow.EcoFlowClient):
+	labels = {"device": device}
+	stats = client.tcp.stats() if hasattr(client.tcp, "stats") else None
+	if stats:
+		_add(families, "ecoflow_connection_up", "gauge", "1 if the device is connected", labels, stats["state"] == "connected")
+		_add(families, "ecoflow_connection_connects", "counter", "Connections made to the device", labels, stats["connects"])
+		_add(families, "ecoflow_connection_connect_failures", "counter", "Failed connection attempts", labels, stats["connect_failures"])
+		_add(families, "ecoflow_connection_idle_timeouts", "counter", "Connections dropped because the device went quiet", labels, stats["idle_timeouts"])
+		_add(families, "ecoflow_connection_received_bytes", "counter", "Bytes received from the device", labels, stats["bytes_received"])
+		_add(families, "ecoflow_connection_reads", "counter", "Reads from the device's socket", labels, stats["reads"])
+		_add(families, "ecoflow_connection_received_bytes_per_second", "gauge", "Average rate since the current connection was made", labels, stats["bytes_per_second"])
+		if stats["connect_latency"] is not None:
+			_add(families, "ecoflow_connection_connect_latency_seconds", "gauge", "Time the last connection took to open", labels, stats["connect_latency"])
+	for (stream, count) in client.messages_received.items():
+		stream_labels = {"device": device, "stream": stream}
+		_add(families, "ecoflow_messages", "counter", "Messages received from the device", stream_labels, count)
+		_add(families, "ecoflow_message_timestamp_seconds", "gauge", "Time the last message was received", stream_labels, client.received_at[stream])
+	_add(families, "ecoflow_unrouted_packets", "counter", "Packets received that nothing handles", labels, sum(client.unrouted.values()))
+
+
+def render(families: Iterable[Family], openmetrics: bool = False) -> bytes:
+	lines = []
+	for (name, kind, help, samples) in families:
+		sample_name = name + "_total" if kind == "counter" else name
+		type_name = name if openmetrics else sample_name
+		lines.append(f"# HELP {type_name} {help}")
+		lines.append(f"# TYPE {type_name} {kind}")
+		for (labels, value) in samples:
+			if labels:
+				label_text = ",".join(f"{k}=\"{_label(v)}\"" for (k, v) in labels.items())
+				lines.append(f"{sample_name}{{{label_text}}} {_value(value)}")
+			else:
+				lines.append(f"{sample_name} {_value(value)}")
+	if openmetrics:
+		lines.append("# EOF")
+	lines.append("")
+	return "\n".join(lines).encode()
+
+
+class Exporter:
+	def __init__(self, cache_seconds: float = 1.0):
+		self.cache_seconds = cache_seconds
+		self.scrapes = 0
+		self.__clients = list[tuple[str, ecoflow.EcoFlowClient]]()
+		self.__collectors = list[Callable[[], Iterable[Family]]]()
+		self.__cache = dict[bool, tuple[float, bytes]]()
+		self.__server: Optional[asyncio.AbstractServer] = None
+
+	def add_client(self, device: str, client: ecoflow.EcoFlowClient):
+		self.__clients.append((device, client))
+
+	#  "collector" is called at every scrape and returns a list of Family
+	def add_collector(self, collector: Callable[[], Iterable[Family]]):
+		self.__collectors.append(collector)
+
+	def collect(self) -> list[Family]:
+		families = dict[str, Family]()
+		for (device, client) in self.__clients:
+			_diagnostics(families, device, client.diagnostics)
+		for (device, client) in self.__clients:
+			_client(families, device, client)
+		for collector in self.__collectors:
+			try:
+				for family in collector():
+					families[family[0]] = family
+			except Exception:
+				_LOGGER.exception("unable to collect metrics")
+		_add(families, "ecoflow_exporter_scrapes", "counter", "Scrapes served", {}, self.scrapes)
+		return list(families.values())
+
+	def metrics(self, openmetrics: bool = False) -> bytes:
+		now = time.monotonic()
+		cached = self.__cache.get(openmetrics)
+		if cached is None or now - cached[0] >= self.cache_seconds:
+			cached = self.__cache[openmetrics] = (now, render(self.collect(), openmetrics))
+		return cached[1]
+
+	async def start(self, host: str, port: int):
+		self.__server = await asyncio.start_server(self.__serve, host or None, port)
+		_LOGGER.info(f"serving metrics on port {port}")
+
+	def close(self):
+		if self.__server:
+			self.__server.close()
+			self.__server = None
+
+	async def __serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+		try:
+			request = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), 10)
+			lines = request.decode("latin-1").split("\r\n")
+			(method, path, *_) = lines[0].split(" ") + [""]
+			headers = {}
+			for line in lines[1:]:
+				(key, _, value) = line.partition(":")
+				headers[key.strip().lower()] = value.strip()
+			if method not in ("GET", "HEAD"):
+				self.__respond(writer, "405 Method Not Allowed", "text/plain", b"Method not allowed\n")
+			elif path.split("?")[0] not in ("/metrics", "/"):
+				self.__respond(writer, "404 Not Found", "text/plain", b"Not found, try /metrics\n")
+			else:
+				self.scrapes += 1
+				openmetrics = "application/openmetrics-text" in headers.get("accept", "")
+				body = self.metrics(openmetrics)
+				self.__respond(writer, "200 OK", OPENMETRICS if openmetrics else PROMETHEUS, b"" if method == "HEAD" else body, len(body))
+			await writer.drain()
+		except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ConnectionError):
+			pass
+		finally:
+			writer.close()
+
+	def __respond(self, writer: asyncio.StreamWriter, status: str, content_type: str, body: bytes, length: Optional[int] = None):
+		writer.write(f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\nContent-Length: {len(body) if length is None else length}\r\nConnection: close\r\n\r\n".encode() + body)
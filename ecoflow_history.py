@@ -0,0 +1,212 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  MIT License
+#
+#  Copyright (C) 2023  David King <dave@daveking.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Keeps every numeric field of EcoFlowClient.diagnostics, not just the ones
+#  the stats table has columns for, in a compact columnar format:
+#
+#    <path>/<device>/<YYYYMMDDHH>/_time.d     sample times, unix seconds
+#    <path>/<device>/<YYYYMMDDHH>/<field>.q   one int64 per sample
+#    <path>/<device>/<YYYYMMDDHH>/<field>.d   one double per sample
+#
+#  One directory per hour (UTC).  Every file in it has one value per sample,
+#  so sample N of any field is at N * 8 bytes and a time range of one field
+#  is read with a seek and one read, without touching the other fields.
+#  Fields are named "<section>.<field>", or "bms.<pack>.<field>" for the
+#  battery packs.  A sample that doesn't have a field holds NaN in .d files
+#  and MISSING in .q files, both are read back as None.
+
+from __future__ import annotations
+from array import array
+from typing import Any, Iterator, Optional
+import bisect
+import datetime
+import logging
+import math
+import os
+
+_LOGGER = logging.getLogger(__name__)
+
+MISSING = -(1 << 63)
+TIME = "_time"
+
+
+def flatten(diagnostics: dict[str, Any]) -> Iterator[tuple[str, Any]]:
+	for section, fields in diagnostics.items():
+		if not isinstance(fields, dict):
+			continue
+		if section == "bms":
+			for pack, pack_fields in fields.items():
+				yield from _numeric(f"bms.{pack}.", pack_fields)
+		else:
+			yield from _numeric(f"{section}.", fields)
+
+
+def _numeric(prefix: str, fields: dict[str, Any]):
+	for name, value in fields.items():
+		if isinstance(value, (int, float)):
+			yield prefix + name, value
+
+
+def _chunk_name(timestamp: float):
+	return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime("%Y%m%d%H")
+
+
+def _missing(typecode: str):
+	return math.nan if typecode == "d" else MISSING
+
+
+#  Samples are kept in memory and appended to the files every
+#  "flush_seconds", opening each file only for as long as that takes, so a
+#  writer doesn't hold a file open for every field
+class HistoryWriter:
+	def __init__(self, path: str, device: str = "", flush_seconds: float = 60):
+		self.path = os.path.join(path, device or "default")
+		self.flush_seconds = flush_seconds
+		self.__chunk: Optional[str] = None
+		#  The values of each field not written yet, and the number of samples
+		#  in the hour so far and written so far
+		self.__pending = dict[str, array]()
+		self.__rows = 0
+		self.__written = 0
+		self.__flushed = 0.0
+
+	def append(self, timestamp: float, diagnostics: dict[str, Any]):
+		chunk = _chunk_name(timestamp)
+		if chunk != self.__chunk:
+			self.__open(chunk)
+		values = dict(flatten(diagnostics))
+		for name in values.keys() - self.__pending.keys():
+			self.__add_column(name, "d" if isinstance(values[name], float) else "q")
+		self.__pending[TIME].append(timestamp)
+		for name, pending in self.__pending.items():
+			if name == TIME:
+				continue
+			value = values.get(name)
+			if value is None:
+				value = _missing(pending.typecode)
+			elif pending.typecode == "q":
+				value = int(value)
+			pending.append(value)
+		self.__rows += 1
+		if timestamp - self.__flushed >= self.flush_seconds:
+			self.flush()
+			self.__flushed = timestamp
+
+	#  _time is written last, a crash part way through leaves it at the
+	#  samples that were complete and __open() evens the other files up to it
+	def flush(self):
+		if self.__rows == self.__written:
+			return
+		directory = os.path.join(self.path, self.__chunk)
+		for name, pending in sorted(self.__pending.items(), key=lambda item: item[0] == TIME):
+			with open(os.path.join(directory, f"{name}.{pending.typecode}"), "ab") as f:
+				_fill(f, pending.typecode, self.__written)
+				f.write(pending.tobytes())
+			del pending[:]
+		self.__written = self.__rows
+
+	def close(self):
+		if self.__chunk is not None:
+			self.flush()
+		self.__pending.clear()
+		self.__chunk = None
+
+	#  Start (or carry on after a restart with) the files of an hour
+	def __open(self, chunk: str):
+		self.close()
+		directory = os.path.join(self.path, chunk)
+		os.makedirs(directory, exist_ok=True)
+		self.__chunk = chunk
+		time_file = os.path.join(directory, TIME + ".d")
+		self.__rows = self.__written = os.path.getsize(time_file) // 8 if os.path.exists(time_file) else 0
+		self.__pending[TIME] = array("d")
+		for filename in sorted(os.listdir(directory)):
+			name, _, typecode = filename.rpartition(".")
+			if name != TIME and typecode in ("d", "q"):
+				self.__add_column(name, typecode)
+
+	def __add_column(self, name: str, typecode: str):
+		self.__pending[name] = array(typecode, (_missing(typecode),)) * (self.__rows - self.__written)
+
+
+#  Trim or pad a file opened for appending to "rows" values, the files cut
+#  short or left long by a crash and the fields that are new this hour
+def _fill(f, typecode: str, rows: int):
+	size = f.tell()
+	there = min(size // 8, rows)
+	if size != there * 8:
+		f.truncate(there * 8)
+	if there < rows:
+		f.write(array(typecode, (_missing(typecode),)).tobytes() * (rows - there))
+
+
+def _chunks(path: str, start: float, end: Optional[float]):
+	first = _chunk_name(start)
+	last = _chunk_name(end) if end is not None else "~"
+	try:
+		names = sorted(os.listdir(path))
+	except FileNotFoundError:
+		return []
+	return [os.path.join(path, name) for name in names if first <= name <= last]
+
+
+def columns(path: str, device: str = "", start: float = 0, end: Optional[float] = None) -> list[str]:
+	names = set[str]()
+	for chunk in _chunks(os.path.join(path, device or "default"), start, end):
+		names.update(filename.rpartition(".")[0] for filename in os.listdir(chunk))
+	names.discard(TIME)
+	return sorted(names)
+
+
+#  The samples of one field between start (inclusive) and end (exclusive),
+#  as a list of times and a list of values
+def read(path: str, device: str, column: str, start: float, end: float) -> tuple[list[float], list]:
+	times = list[float]()
+	values = list()
+	for chunk in _chunks(os.path.join(path, device or "default"), start, end):
+		chunk_times = array("d")
+		with open(os.path.join(chunk, TIME + ".d"), "rb") as f:
+			chunk_times.frombytes(f.read())
+		first = bisect.bisect_left(chunk_times, start)
+		last = bisect.bisect_left(chunk_times, end)
+		if first >= last:
+			continue
+		for typecode in ("d", "q"):
+			filename = os.path.join(chunk, f"{column}.{typecode}")
+			if os.path.exists(filename):
+				break
+		else:
+			continue
+		chunk_values = array(typecode)
+		with open(filename, "rb") as f:
+			f.seek(first * 8)
+			chunk_values.frombytes(f.read((last - first) * 8))
+		times.extend(chunk_times[first:first + len(chunk_values)])
+		if typecode == "d":
+			values.extend(None if math.isnan(value) else value for value in chunk_values)
+		else:
+			values.extend(None if value == MISSING else value for value in chunk_values)
+	return times, values
@@ -0,0 +1,240 @@
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  MIT License
+#
+#  Copyright (C) 2023  David King <dave@daveking.com>
+#
+#  Permission is hereby granted, free of charge, to any person obtaining a copy
+#  of this software and associated documentation files (the "Software"), to deal
+#  in the Software without restriction, including without limitation the rights
+#  to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+#  copies of the Software, and to permit persons to whom the Software is
+#  furnished to do so, subject to the following conditions:
+#
+#  The above copyright notice and this permission notice shall be included in all
+#  copies or substantial portions of the Software.
+#
+#  THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+#  IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+#  FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+#  AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+#  LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+#  OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+#  SOFTWARE.
+#
+# # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # # #
+#
+#  Records what a TcpAutoConnection (or RxTcpAutoConnection) receives, and
+#  plays it back through EcoFlowClient.feed(), which is the same FrameReader,
+#  decode_packet() and parsers that a live connection goes through.
+#
+#  A recording is a directory of segment files, each named after the time its
+#  first record was received in nanoseconds:
+#
+#    <ns>.rec  records of <d receive time> <I length> <length bytes>.  A
+#              zero length record marks a dropped connection.
+#    <ns>.idx  entries of <d receive time> <Q offset of that record in .rec>,
+#              one every "index_seconds", to seek to a point in time.
+#
+#  With frames=True only the frames that pass the CRC checks are recorded, one
+#  per record, instead of the chunks of bytes as they came off the socket.
+#
+#     recorder = FrameRecorder("/var/tmp/ecoflow").attach(client.tcp)
+#     ...
+#     client = ReplayClient("DELTA Pro")
+#     await replay("/var/tmp/ecoflow", client, speed=1.0)
+
+from __future__ import annotations
+from typing import Callable, Iterable, Iterator, Optional
+import asyncio
+import bisect
+import logging
+import os
+import struct
+import time
+
+import ecoflow
+
+_LOGGER = logging.getLogger(__name__)
+
+RECORD = struct.Struct("<dI")
+INDEX = struct.Struct("<dQ")
+
+
+class FrameRecorder:
+	def __init__(self, path: str, frames: bool = False, segment_bytes: int = 64 << 20, index_seconds: float = 1.0, flush_seconds: float = 1.0):
+		self.path = path
+		self.segment_bytes = segment_bytes
+		self.index_seconds = index_seconds
+		self.flush_seconds = flush_seconds
+		self.__reader = ecoflow.FrameReader() if frames else None
+		self.__rec = None
+		self.__idx = None
+		self.__indexed = 0.0
+		self.__flushed = 0.0
+		os.makedirs(path, exist_ok=True)
+
+	def attach(self, connection: ecoflow.TcpAutoConnection):
+		connection.add_listener(self.record)
+		return self
+
+	#  A TcpAutoConnection listener: bytes received, None when disconnected
+	def record(self, data: Optional[bytes], received: Optional[float] = None):
+		if received is None:
+			received = time.time()
+		if data is None:
+			if self.__reader:
+				self.__reader.reset()
+			self.__write(received, b"")
+			self.flush()
+		elif self.__reader:
+			for frame in self.__reader.feed(data):
+				self.__write(received, frame)
+		else:
+			self.__write(received, data)
+		if received - self.__flushed >= self.flush_seconds:
+			self.flush()
+			self.__flushed = received
+
+	def flush(self):
+		if self.__rec:
+			self.__rec.flush()
+			self.__idx.flush()
+
+	def close(self):
+		if self.__rec:
+			self.__rec.close()
+			self.__idx.close()
+		self.__rec = None
+		self.__idx = None
+
+	def __write(self, received: float, data: bytes):
+		if self.__rec is None or self.__rec.tell() >= self.segment_bytes:
+			self.close()
+			name = os.path.join(self.path, "{:020d}".format(int(received * 1e9)))
+			self.__rec = open(name + ".rec", "ab")
+			self.__idx = open(name + ".idx", "ab")
+			self.__indexed = 0.0
+		if received - self.__indexed >= self.index_seconds:
+			self.__idx.write(INDEX.pack(received, self.__rec.tell()))
+			self.__indexed = received
+		self.__rec.write(RECORD.pack(received, len(data)))
+		self.__rec.write(data)
+
+
+#  The complete index entries in a file, a crash can leave half of one
+def _whole(f):
+	data = f.read()
+	return data[:len(data) - len(data) % INDEX.size]
+
+
+def _segments(path: str):
+	return sorted(os.path.join(path, name[:-4]) for name in os.listdir(path) if name.endswith(".rec"))
+
+
+#  The (receive time, bytes) records from "start" (inclusive) to "end"
+#  (exclusive), with b"" for a dropped connection
+def records(path: str, start: Optional[float] = None, end: Optional[float] = None) -> Iterator[tuple[float, bytes]]:
+	segments = _segments(path)
+	for (i, segment) in enumerate(segments):
+		if end is not None and int(os.path.basename(segment)) / 1e9 >= end:
+			return
+		if start is not None and i + 1 < len(segments) and int(os.path.basename(segments[i + 1])) / 1e9 <= start:
+			continue
+		offset = 0
+		if start is not None:
+			with open(segment + ".idx", "rb") as f:
+				index = list(INDEX.iter_unpack(_whole(f)))
+			times = [t for (t, _) in index]
+			at = bisect.bisect_right(times, start) - 1
+			if at >= 0:
+				offset = index[at][1]
+		with open(segment + ".rec", "rb") as f:
+			f.seek(offset)
+			while True:
+				header = f.read(RECORD.size)
+				if len(header) < RECORD.size:
+					break
+				(received, length) = RECORD.unpack(header)
+				data = f.read(length)
+				if len(data) < length:
+					_LOGGER.warning(f"ignoring a partial record at the end of {segment}.rec")
+					break
+				if start is not None and received < start:
+					continue
+				if end is not None and received >= end:
+					return
+				yield (received, data)
+
+
+#  Stands in for TcpAutoConnection, replay() pushes the recorded bytes to its
+#  listeners and anything written to it is dropped
+class ReplayConnection:
+	def __init__(self, host: str = "replay", port: int = 0):
+		self.host = host
+		self.port = port
+		self.__listeners = list[Callable[[Optional[bytes]], None]]()
+
+	def add_listener(self, listener: Callable[[Optional[bytes]], None]):
+		self.__listeners.append(listener)
+
+	def close(self):
+		pass
+
+	async def drain(self):
+		pass
+
+	def reconnect(self):
+		pass
+
+	async def wait_closed(self):
+		pass
+
+	async def wait_opened(self):
+		pass
+
+	async def wait_connected(self):
+		pass
+
+	def write(self, data: bytes):
+		pass
+
+	def _received(self, data: Optional[bytes]):
+		for listener in self.__listeners:
+			listener(data)
+
+
+class ReplayClient(ecoflow.EcoFlowClient):
+	_connection = ReplayConnection
+
+	def __init__(self, product_name, timeout=None, projection: Optional[dict[str, Iterable[str]]] = None):
+		super().__init__(product_name, "replay", timeout, projection)
+
+
+#  Needs reactivex, like RxEcoFlowClient
+class RxReplayClient(ecoflow.RxEcoFlowClient):
+	_connection = ReplayConnection
+
+	def __init__(self, product_name, timeout=None, projection: Optional[dict[str, Iterable[str]]] = None):
+		super().__init__(product_name, "replay", timeout, projection)
+
+
+#  Play a recording into a ReplayClient or RxReplayClient.  "speed" is None to
+#  go as fast as possible, 1.0 for the pace it was recorded at, 2.0 for twice
+#  that, and so on.  Returns the number of records played.
+async def replay(path: str, client: ecoflow.EcoFlowClient, start: Optional[float] = None, end: Optional[float] = None, speed: Optional[float] = None) -> int:
+	loop = asyncio.get_running_loop()
+	count = 0
+	began = None
+	for (received, data) in records(path, start, end):
+		if speed:
+			if began is None:
+				began = (loop.time(), received)
+			delay = began[0] + (received - began[1]) / speed - loop.time()
+			await asyncio.sleep(max(0, delay))
+		else:
+			#  Let messages() consumers keep up
+			await asyncio.sleep(0)
+		client.tcp._received(data or None)
+		count += 1
+	return count